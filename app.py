@@ -1,17 +1,26 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+import os
+# The autoencoder is a tiny single-row model; keep TensorFlow off the GPU
+# (must be set before tensorflow is imported)
+os.environ["CUDA_VISIBLE_DEVICES"] = ""
 import numpy as np
 import joblib
+from numba import njit
+import tensorflow as tf
 from tensorflow.keras.models import load_model
 from firebase_admin import credentials, db
 import firebase_admin
 from datetime import datetime, timedelta
-import requests
+import httpx
 import time
 import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor, wait
+from functools import lru_cache, partial
 
-import os
 import json
+import tempfile
 
 app = FastAPI()
 
@@ -45,19 +54,131 @@ firebase_admin.initialize_app(cred, {
     "databaseURL": "https://esp32---demo-ac37f-default-rtdb.europe-west1.firebasedatabase.app"
 })
 
-autoencoder = load_model(
-    "models/global_climate_autoencoder.h5",
-    compile=False
-)
+# One op thread is plenty for a 15-feature model and avoids TF's thread
+# pools competing with the Firebase/NASA worker threads.
+tf.config.set_visible_devices([], "GPU")
+tf.config.threading.set_intra_op_parallelism_threads(1)
+tf.config.threading.set_inter_op_parallelism_threads(1)
+
+# Convert the Keras autoencoder to a quantized TFLite model once (and again
+# whenever the .h5 changes). Keras predict() carries far more per-call
+# overhead than the actual 15-feature forward pass.
+AUTOENCODER_H5 = "models/global_climate_autoencoder.h5"
+AUTOENCODER_TFLITE = "models/autoencoder.tflite"
+
+def check_tflite_parity(keras_model, tflite_model, rows=64, rtol=0.01):
+    """Raise if the converted model's reconstruction error drifts from Keras.
+
+    THRESHOLD was calibrated on the Keras model, so the TFLite model must
+    reproduce its anomaly scores on inputs in the scaler's [0, 1] range.
+    """
+    X = np.random.default_rng(0).uniform(0, 1, (rows, 15)).astype(np.float32)
+    expected = np.mean((X - keras_model(X, training=False).numpy()) ** 2, axis=1)
+
+    check = tf.lite.Interpreter(model_content=tflite_model)
+    check.allocate_tensors()
+    in_idx = check.get_input_details()[0]["index"]
+    out_idx = check.get_output_details()[0]["index"]
+    for row, exp in zip(X, expected):
+        check.set_tensor(in_idx, row.reshape(1, -1))
+        check.invoke()
+        err = float(np.mean((row - check.get_tensor(out_idx)) ** 2))
+        if not abs(err - exp) <= rtol * exp:
+            raise RuntimeError(
+                f"TFLite autoencoder disagrees with Keras: MSE {err:.6f} vs {exp:.6f}"
+            )
+
+if (not os.path.exists(AUTOENCODER_TFLITE)
+        or os.path.getmtime(AUTOENCODER_TFLITE) < os.path.getmtime(AUTOENCODER_H5)):
+    keras_model = load_model(AUTOENCODER_H5, compile=False)
+    # Trace with a fixed (1, 15) float32 signature: inference is always one
+    # row per field, so the converted graph needs no dynamic batch dimension.
+    serve = tf.function(
+        lambda x: keras_model(x, training=False),
+        input_signature=[tf.TensorSpec((1, 15), tf.float32)],
+    )
+    # No trackable_obj here: passing the Keras model as the trackable makes
+    # the converted model output NaN with Keras 3.
+    converter = tf.lite.TFLiteConverter.from_concrete_functions(
+        [serve.get_concrete_function()]
+    )
+    # float16 weights: int8 dynamic-range quantization shifted the anomaly
+    # score by up to ~13%, against a THRESHOLD calibrated on the float model.
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.target_spec.supported_types = [tf.float16]
+    tflite_model = converter.convert()
+    check_tflite_parity(keras_model, tflite_model)
+    # Write to a temp file and swap it in, so a failed/killed conversion or a
+    # concurrently starting worker never sees a truncated model.
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(AUTOENCODER_TFLITE), suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(tflite_model)
+    os.replace(tmp_path, AUTOENCODER_TFLITE)
+
+interpreter = tf.lite.Interpreter(model_path=AUTOENCODER_TFLITE, num_threads=1)
+interpreter.allocate_tensors()
+input_index = interpreter.get_input_details()[0]["index"]
+output_index = interpreter.get_output_details()[0]["index"]
+# Warm-up invoke so the first real prediction doesn't pay delegate/kernel setup
+interpreter.set_tensor(input_index, np.zeros((1, 15), dtype=np.float32))
+interpreter.invoke()
+# tf.lite.Interpreter is not thread-safe; the lock also guards recon_diff
+interpreter_lock = threading.Lock()
+# Scratch buffer for the reconstruction error
+recon_diff = np.empty((1, 15), dtype=np.float32)
+
 scaler = joblib.load("models/global_climate_scaler.pkl")
+# Apply the MinMaxScaler by hand (clip=False); scaler.transform() re-validates
+# its input on every call, which costs more than the arithmetic for one row.
+SCALER_SCALE = scaler.scale_.astype(np.float32)
+SCALER_MIN = scaler.min_.astype(np.float32)
+
+# Make sure the inlined transform still agrees with the pickled scaler
+_sample = (scaler.data_min_ + 0.37 * scaler.data_range_).astype(np.float32)
+if not np.allclose(
+    _sample * SCALER_SCALE + SCALER_MIN,
+    scaler.transform(_sample.reshape(1, -1))[0],
+    rtol=1e-4, atol=1e-5,
+):
+    raise RuntimeError("Inlined scaler transform does not match scaler.transform()")
 
 with open("models/global_climate_threshold.txt") as f:
     THRESHOLD = float(f.read())
+INV_THRESHOLD = 1.0 / THRESHOLD
+WATCH_THRESHOLD = THRESHOLD * 0.7
+
+# Minimum gap between two history entries of the same field (25 minutes)
+ARCHIVE_INTERVAL_MS = 1500000
+# Last archived timestamp per (user_id, field_id), so most cycles can skip
+# the history lookup in Firebase. Filled lazily after a restart.
+LAST_ARCHIVE_TS = {}
+
+# Worker pool for per-field processing (I/O bound: Firebase + NASA requests)
+EXECUTOR = ThreadPoolExecutor(max_workers=16)
+# Fields queued or running on EXECUTOR, so a burst of env pushes from one
+# device doesn't process the same field several times
+PENDING_FIELDS = set()
+# Fields whose env changed while they were running or inside the archive
+# interval; re-queued by dirty_field_sweeper
+DIRTY_FIELDS = set()
+pending_lock = threading.Lock()
+# Firebase listeners by user_id
+LISTENERS = {}
+
+# Shared HTTP/2 client so NASA POWER requests reuse one keep-alive connection
+HTTP_CLIENT = httpx.Client(http2=True, timeout=5)
+# Fans out the per-date NASA requests. Separate from EXECUTOR because
+# fetch_solar runs on EXECUTOR and blocks on these; sharing it could deadlock.
+SOLAR_EXECUTOR = ThreadPoolExecutor(max_workers=10)
+# Per-date failures that just mean "no value for this date" (HTTP errors and
+# malformed payloads, e.g. a JSON list or "properties": null -> TypeError)
+SOLAR_ERRORS = (httpx.HTTPError, KeyError, ValueError, IndexError, AttributeError, TypeError)
 
 # -----------------------
 # UTILITY FUNCTIONS
 # -----------------------
 
+@njit(cache=True, fastmath=True)
 def dew_point(temp, rh):
     a, b = 17.27, 237.7
     # Ensure RH is not 0 to avoid log error
@@ -69,73 +190,139 @@ def get_latest_solar(lat, lon):
     # Default fallback if no lat/lon
     if not lat or not lon:
         return 0.0
-        
-    for i in range(0, 5): # Try last 5 days
-        date = (datetime.utcnow() - timedelta(days=i)).strftime("%Y%m%d")
-        url = (
-            "https://power.larc.nasa.gov/api/temporal/daily/point"
-            f"?parameters=ALLSKY_SFC_SW_DWN"
-            f"&latitude={lat}&longitude={lon}"
-            f"&start={date}&end={date}&format=JSON"
-        )
-        try:
-            r = requests.get(url, timeout=5).json()
-            val = list(
-                r["properties"]["parameter"]["ALLSKY_SFC_SW_DWN"].values()
-            )[0]
-            if val != -999.0: # NASA error code
-                return val
-        except:
-            continue
-    return 5.0 # Fallback average solar
 
-def summarize(values):
-    return np.mean(values), np.min(values), np.max(values)
+    try:
+        lat, lon = round(float(lat), 2), round(float(lon), 2)
+    except (TypeError, ValueError):
+        return 5.0 # Fallback average solar (malformed device coordinates)
+
+    # Cached per ~1 km cell and UTC day: NASA POWER publishes daily values, and
+    # fields that share coordinates would otherwise repeat the same requests.
+    try:
+        return fetch_solar(lat, lon, datetime.utcnow().strftime("%Y%m%d"))
+    except LookupError:
+        return 5.0 # Fallback average solar
+
+@lru_cache(maxsize=256)
+def fetch_solar(lat, lon, day):
+    """Latest valid ALLSKY_SFC_SW_DWN for the 5 days up to `day`.
+
+    Raises LookupError when none is available so that failures are not cached.
+    """
+    today = datetime.strptime(day, "%Y%m%d")
+    dates = [
+        (today - timedelta(days=i)).strftime("%Y%m%d") for i in range(0, 5) # Try last 5 days
+    ]
+    # Request all dates at once over the shared client so the worst case is
+    # one round-trip instead of five sequential ones.
+    futures = [
+        SOLAR_EXECUTOR.submit(fetch_solar_day, solar_url(lat, lon, date)) for date in dates
+    ]
+    wait(futures)
+
+    values = []
+    for future in futures:
+        error = future.exception()
+        if error is None:
+            values.append(future.result())
+        elif not isinstance(error, SOLAR_ERRORS):
+            # Unexpected errors surface whichever date hit them
+            raise error
+
+    # Newest date first
+    for val in values:
+        if val != -999.0: # NASA error code
+            return val
+    raise LookupError(f"No solar data for {lat},{lon} up to {day}")
+
+def solar_url(lat, lon, date):
+    return (
+        "https://power.larc.nasa.gov/api/temporal/daily/point"
+        f"?parameters=ALLSKY_SFC_SW_DWN"
+        f"&latitude={lat}&longitude={lon}"
+        f"&start={date}&end={date}&format=JSON"
+    )
+
+def fetch_solar_day(url):
+    resp = HTTP_CLIENT.get(url)
+    resp.raise_for_status()
+    r = resp.json()
+    return list(
+        r["properties"]["parameter"]["ALLSKY_SFC_SW_DWN"].values()
+    )[0]
+
+@njit(cache=True, fastmath=True)
+def build_features(raw, solar):
+    """Build the 15-feature model input from an (n, 2) [temp, hum] array.
+
+    Layout: mean/min/max of temp, hum, dew point and temp - dew point,
+    followed by solar radiation three times. Everything is accumulated in
+    a single pass over the records.
+    """
+    n = raw.shape[0]
+    sums = np.empty(4, dtype=np.float64)
+    mins = np.empty(4, dtype=np.float64)
+    maxs = np.empty(4, dtype=np.float64)
+    vals = np.empty(4, dtype=np.float64)
+    for i in range(n):
+        vals[0] = raw[i, 0]
+        vals[1] = raw[i, 1]
+        vals[2] = dew_point(vals[0], vals[1])
+        vals[3] = vals[0] - vals[2]
+        for k in range(4):
+            v = vals[k]
+            # Seed from the first row rather than +/-inf sentinels:
+            # fastmath lets LLVM assume no infinities.
+            if i == 0:
+                sums[k] = v
+                mins[k] = v
+                maxs[k] = v
+                continue
+            sums[k] += v
+            if v < mins[k]:
+                mins[k] = v
+            if v > maxs[k]:
+                maxs[k] = v
+
+    features = np.empty(15, dtype=np.float32)
+    for k in range(4):
+        features[3 * k] = sums[k] / n
+        features[3 * k + 1] = mins[k]
+        features[3 * k + 2] = maxs[k]
+    features[12] = solar
+    features[13] = solar
+    features[14] = solar
+    return features
+
+
+# Pay the JIT compile cost at import rather than on the first field
+build_features(np.zeros((48, 2), dtype=np.float32), 0.0)
+
+def write_updates(updates):
+    """Apply several path -> value writes in one multi-location update."""
+    if updates:
+        db.reference("/").update(updates)
 
 # -------------------------------------------------------------------
 # Soil‑moisture helper functions (grid‑level risk weighting)
 # -------------------------------------------------------------------
 
-def soil_category(soil):
-    """Return DRY / MODERATE / WET based on percentage value."""
-    if soil < 30:
-        return "DRY"
-    elif soil < 60:
-        return "MODERATE"
-    else:
-        return "WET"
+# (farm_risk, soil category) -> probe risk. Soil is DRY below 30%, MODERATE
+# below 60% and WET otherwise.
+GRID_RISK = {
+    ("NORMAL", "DRY"): "NORMAL", ("NORMAL", "MODERATE"): "NORMAL", ("NORMAL", "WET"): "NORMAL",
+    ("WATCH", "DRY"): "NORMAL", ("WATCH", "MODERATE"): "WATCH", ("WATCH", "WET"): "WARNING",
+    ("WARNING", "DRY"): "WATCH", ("WARNING", "MODERATE"): "WARNING", ("WARNING", "WET"): "HIGH",
+    ("HIGH", "DRY"): "WARNING", ("HIGH", "MODERATE"): "HIGH", ("HIGH", "WET"): "HIGH",
+}
 
 
 def grid_risk(farm_risk, soil):
     """Combine farm‑level climate risk with soil moisture category.
-    Returns one of: NORMAL, WATCH, WARNING, HIGH.
+    Returns one of: NORMAL, WATCH, WARNING, HIGH (None if farm_risk is unknown).
     """
-    soil_cat = soil_category(soil)
-
-    if farm_risk == "NORMAL":
-        return "NORMAL"
-
-    if farm_risk == "WATCH":
-        if soil_cat == "WET":
-            return "WARNING"
-        elif soil_cat == "MODERATE":
-            return "WATCH"
-        else:
-            return "NORMAL"
-
-    if farm_risk == "WARNING":
-        if soil_cat == "WET":
-            return "HIGH"
-        elif soil_cat == "MODERATE":
-            return "WARNING"
-        else:
-            return "WATCH"
-
-    if farm_risk == "HIGH":
-        if soil_cat == "DRY":
-            return "WARNING"
-        else:
-            return "HIGH"
+    soil_cat = "DRY" if soil < 30 else ("MODERATE" if soil < 60 else "WET")
+    return GRID_RISK.get((farm_risk, soil_cat))
 
 
 # -----------------------
@@ -147,9 +334,13 @@ def process_field(user_id, field_id, env_data):
     1. Archive live env data to history
     2. Read history
     3. Predict if enough data
+
+    Nothing is written here. Returns (risk, updates) where updates maps
+    root-relative paths to values for a single multi-location update;
+    risk is None when no prediction could be made.
     """
     if "temp" not in env_data or "hum" not in env_data:
-        return
+        return None, {}
 
     # 1. Archive Data
     timestamp = str(int(time.time() * 1000))
@@ -159,29 +350,40 @@ def process_field(user_id, field_id, env_data):
         "timestamp": timestamp
     }
     
+    # All writes for this field are collected here and sent by the caller as
+    # a single multi-location update (one round-trip instead of one per .set()).
+    updates = {}
+
     # Check last entry to prevent duplicates (spam)
     # Target: users/{user_id}/history/{field_id}
-    history_root = db.reference(f"users/{user_id}/history/{field_id}")
-    last_entry = history_root.order_by_key().limit_to_last(1).get()
+    current_ts = int(timestamp)
+    last_ts = LAST_ARCHIVE_TS.get((user_id, field_id))
+    if last_ts is None:
+        # Cold cache (e.g. after a restart): read the stored last archive time.
+        # A scalar leaf, so the read doesn't grow with the history subtree.
+        last_ts = db.reference(
+            f"users/{user_id}/live_status/{field_id}/last_archive_ts"
+        ).get()
+        if last_ts:
+            last_ts = int(last_ts)
+            LAST_ARCHIVE_TS[(user_id, field_id)] = last_ts
+        else:
+            last_ts = None
     
-    if last_entry:
-        last_ts = int(list(last_entry.keys())[0])
-        current_ts = int(timestamp)
-        # If less than 25 minutes (1500000 ms) has passed, skip archiving
+    archive = True
+    if last_ts is not None:
+        # If less than 25 minutes has passed, skip archiving
         diff = current_ts - last_ts
-        if diff < 1500000:
+        if diff < ARCHIVE_INTERVAL_MS:
             print(f"Skipping archive for {field_id}: Last update was {diff/1000:.1f}s ago (Need 1500s)")
             # Do NOT return here; proceed to prediction logic
-        else:
-            # Save to history bucket only if time gap is met
-            history_ref = db.reference(f"users/{user_id}/history/{field_id}")
-            history_ref.child(timestamp).set(data_entry)
-            print(f"✅ Archived data to users/{user_id}/history/{field_id}/{timestamp}")
+            archive = False
 
-    else:
-        # Case where no history exists yet - create first entry
-        history_ref = db.reference(f"users/{user_id}/history/{field_id}")
-        history_ref.child(timestamp).set(data_entry)
+    if archive:
+        # Save to history bucket only if time gap is met (or no history exists yet)
+        updates[f"users/{user_id}/history/{field_id}/{timestamp}"] = data_entry
+        updates[f"users/{user_id}/live_status/{field_id}/last_archive_ts"] = current_ts
+        LAST_ARCHIVE_TS[(user_id, field_id)] = current_ts
         print(f"✅ Archived data to users/{user_id}/history/{field_id}/{timestamp}")
     
     # Fetch last 47 entries from historical_logs (we add current live data as the 48th)
@@ -190,33 +392,27 @@ def process_field(user_id, field_id, env_data):
     
     if not logs:
         print(f"No historical logs for {field_id}")
-        return
+        return None, updates
     
     # Extract temperature and humidity from historical logs
-    records = []
+    raw = np.empty((48, 2), dtype=np.float32)
+    count = 0
     for entry in logs.values():
-        env = entry.get("env", {})
+        env = (entry.get("env") or {}) if isinstance(entry, dict) else {}
         temp = env.get("temp")
         hum = env.get("hum")
         if temp is None or hum is None:
             continue
-        records.append({"temperature": float(temp), "humidity": float(hum)})
+        raw[count] = (float(temp), float(hum))
+        count += 1
 
     # Append the CURRENT live reading as the latest record
-    records.append({
-        "temperature": float(env_data["temp"]),
-        "humidity": float(env_data["hum"])
-    })
+    raw[count] = (float(env_data["temp"]), float(env_data["hum"]))
+    count += 1
     
-    if len(records) < 48:
-        print(f"Insufficient valid env data for {field_id}: {len(records)}/48")
-        return
-
-    # 2. Prepare for Prediction using records from historical_logs
-    temps = [r["temperature"] for r in records]
-    hums = [r["humidity"] for r in records]
-    dews = [dew_point(t, h) for t, h in zip(temps, hums)]
-    dpdiffs = [t - d for t, d in zip(temps, dews)]
+    if count < 48:
+        print(f"Insufficient valid env data for {field_id}: {count}/48")
+        return None, updates
 
     # Hardcoded Lat/Lon or fetch if available
     lat, lon = 20.5937, 78.9629
@@ -225,21 +421,23 @@ def process_field(user_id, field_id, env_data):
     
     solar = get_latest_solar(lat, lon)
 
-    features = []
-    for arr in [temps, hums, dews, dpdiffs]:
-        features.extend(summarize(arr))
-
-    features.extend([solar, solar, solar])
+    # 2. Prepare for Prediction using records from historical_logs
+    features = build_features(raw, float(solar))
 
     # 3. Predict
-    X = scaler.transform([features])
-    recon = autoencoder.predict(X)
-    error = float(np.mean((X - recon) ** 2))
+    X = (features * SCALER_SCALE + SCALER_MIN).reshape(1, -1)
+    with interpreter_lock:
+        interpreter.set_tensor(input_index, X)
+        interpreter.invoke()
+        recon = interpreter.get_tensor(output_index)
+        np.subtract(X, recon, out=recon_diff)
+        np.square(recon_diff, out=recon_diff)
+        error = float(recon_diff.mean())
 
     risk = "NORMAL"
     if error > THRESHOLD:
         risk = "HIGH"
-    elif error > (THRESHOLD * 0.7):
+    elif error > WATCH_THRESHOLD:
         risk = "WATCH"
 
     # 4. Write Prediction
@@ -252,20 +450,152 @@ def process_field(user_id, field_id, env_data):
     elif risk == "WATCH":
         reason = "Elevated risk parameters detected"
 
-    db.reference(
-        f"users/{user_id}/live_status/{field_id}/prediction"
-    ).set({
+    updates[f"users/{user_id}/live_status/{field_id}/prediction"] = {
         "risk": risk,
         "anomaly_score": error,
-        "confidence": round(error / THRESHOLD, 2),
+        "confidence": round(error * INV_THRESHOLD, 2),
         "reason": reason,
         "lastUpdated": datetime.utcnow().isoformat()
-    })
-    print(f"Prediction for {field_id}: {risk} (Err: {error:.4f}) Written to live_status")
-    return risk
+    }
+    print(f"Prediction for {field_id}: {risk} (Err: {error:.4f})")
+    return risk, updates
+
+
+def handle_field(user_id, field_id):
+    """Run the farm-level prediction for one field, then weight it per probe."""
+    try:
+        print(f"Checking field: {field_id}")
+        # Read only the env and probes children; the rest of the field node
+        # (predictions etc.) is never needed here.
+        field_ref = db.reference(f"users/{user_id}/live_status/{field_id}")
+        env = field_ref.child("env").get()
+        if not isinstance(env, dict):
+            print(f"Skipping {field_id} (No env data)")
+            return
+
+        print(f"Processing env data for {field_id}...")
+        farm_risk, updates = process_field(user_id, field_id, env)
+        # Apply soil‑moisture based grid weighting for specific probes
+        probes = field_ref.child("probes").get()
+        if isinstance(probes, dict):
+            for probe_id, probe_data in probes.items():
+                if not isinstance(probe_data, dict): continue
+                
+                raw_moisture = probe_data.get("raw_moisture")
+                if raw_moisture is not None:
+                    try:
+                        moisture_val = float(raw_moisture)
+                        probe_risk_level = grid_risk(farm_risk, moisture_val)
+                        
+                        # Queue probe specific prediction
+                        updates[
+                            f"users/{user_id}/live_status/{field_id}/probes/{probe_id}/prediction"
+                        ] = probe_risk_level
+                        print(f"Probe {probe_id}: Moisture {moisture_val}% -> {probe_risk_level}")
+                    except ValueError as e:
+                        print(f"Invalid moisture for probe {probe_id}: {repr(raw_moisture)} Error: {e}")
+                    except Exception as e:
+                        print(f"Unexpected error for probe {probe_id}: {e}")
+
+        # History entry, farm prediction and probe predictions in one round-trip
+        write_updates(updates)
+        if farm_risk is not None:
+            print(f"Prediction for {field_id} written to live_status")
+    except Exception as e:
+        print(f"Field Error for {user_id}/{field_id}: {e}")
+        traceback.print_exc()
+        # The queued archive may not have been written; re-read it next time
+        LAST_ARCHIVE_TS.pop((user_id, field_id), None)
+
+
+def schedule_field(user_id, field_id):
+    """Queue a field on the worker pool, at most once per archive interval.
+
+    Env changes inside the interval are deferred, not dropped: the field is
+    marked dirty and dirty_field_sweeper runs it once the interval has passed.
+    """
+    key = (user_id, field_id)
+    with pending_lock:
+        last_ts = LAST_ARCHIVE_TS.get(key)
+        recent = last_ts is not None and time.time() * 1000 - last_ts < ARCHIVE_INTERVAL_MS
+        if recent or key in PENDING_FIELDS:
+            # A run in progress may already have read older env data
+            DIRTY_FIELDS.add(key)
+            return
+        DIRTY_FIELDS.discard(key)
+        PENDING_FIELDS.add(key)
+    EXECUTOR.submit(run_field, user_id, field_id)
+
+
+def run_field(user_id, field_id):
+    try:
+        handle_field(user_id, field_id)
+    finally:
+        with pending_lock:
+            PENDING_FIELDS.discard((user_id, field_id))
+
+
+def dirty_field_sweeper():
+    """Retry deferred fields so the latest env is processed once its window ends."""
+    while True:
+        time.sleep(60)
+        try:
+            with pending_lock:
+                dirty = list(DIRTY_FIELDS)
+            for user_id, field_id in dirty:
+                schedule_field(user_id, field_id)
+        except Exception as e:
+            print(f"Sweeper Error: {e}")
+            traceback.print_exc()
+
+
+def on_live_status_event(user_id, event):
+    """Listener callback for users/{user_id}/live_status.
+
+    Only env changes schedule work; our own prediction/probe writes also show
+    up here and are ignored.
+    """
+    try:
+        if event.data is None:
+            return
+        if event.event_type == "patch":
+            # Patch data is keyed by paths relative to event.path
+            base = event.path.rstrip("/")
+            changes = {f"{base}/{key}": value for key, value in event.data.items()}
+        else:
+            changes = {event.path: event.data}
+
+        # A patch usually touches several keys of one field (e.g. env/temp and
+        # env/hum); collect field ids so each is scheduled once per event.
+        field_ids = set()
+        for path, value in changes.items():
+            parts = [p for p in path.split("/") if p]
+            if not parts:
+                # Whole live_status node (initial snapshot when the listener starts)
+                if isinstance(value, dict):
+                    for field_id, field_data in value.items():
+                        if isinstance(field_data, dict) and "env" in field_data:
+                            field_ids.add(field_id)
+            elif len(parts) == 1:
+                if isinstance(value, dict) and "env" in value:
+                    field_ids.add(parts[0])
+            elif parts[1] == "env":
+                field_ids.add(parts[0])
+
+        for field_id in field_ids:
+            schedule_field(user_id, field_id)
+    except Exception as e:
+        # An exception here would stop the listener thread
+        print(f"Listener Error for {user_id}: {e}")
+        traceback.print_exc()
 
 
 def prediction_loop():
+    """Attach a live_status listener for every user.
+
+    Fields are processed when their env data changes (see
+    on_live_status_event); this loop only picks up newly created users.
+    """
     print("--- Starting Prediction Loop ---")
     while True:
         try:
@@ -274,57 +604,47 @@ def prediction_loop():
             print(f"Found {len(users)} users.")
             
             for user_id in users.keys():
-                print(f"Checking user: {user_id}")
-                # Check live_status
-                ls_ref = db.reference(f"users/{user_id}/live_status")
-                live_status = ls_ref.get()
-                
-                if not live_status:
-                    print(f"No live_status for {user_id}")
+                if user_id in LISTENERS:
                     continue
-                
-                for field_id, field_data in live_status.items():
-                    print(f"Checking field: {field_id}")
-                    if isinstance(field_data, dict) and "env" in field_data:
-                        print(f"Processing env data for {field_id}...")
-                        farm_risk = process_field(user_id, field_id, field_data["env"])
-                        # Apply soil‑moisture based grid weighting for specific probes
-                        probes = field_data.get("probes", {})
-                        if probes:
-                            for probe_id, probe_data in probes.items():
-                                if not isinstance(probe_data, dict): continue
-                                
-                                raw_moisture = probe_data.get("raw_moisture")
-                                if raw_moisture is not None:
-                                    try:
-                                        moisture_val = float(raw_moisture)
-                                        probe_risk_level = grid_risk(farm_risk, moisture_val)
-                                        
-                                        # Write probe specific prediction
-                                        db.reference(
-                                            f"users/{user_id}/live_status/{field_id}/probes/{probe_id}/prediction"
-                                        ).set(probe_risk_level)
-                                        print(f"Probe {probe_id}: Moisture {moisture_val}% -> {probe_risk_level}")
-                                    except ValueError as e:
-                                        print(f"Invalid moisture for probe {probe_id}: {repr(raw_moisture)} Error: {e}")
-                                    except Exception as e:
-                                        print(f"Unexpected error for probe {probe_id}: {e}")
-                    else:
-                        print(f"Skipping {field_id} (No env data)")
+                print(f"Listening to live_status for user: {user_id}")
+                try:
+                    LISTENERS[user_id] = db.reference(f"users/{user_id}/live_status").listen(
+                        partial(on_live_status_event, user_id)
+                    )
+                except Exception as e:
+                    # Retried on the next pass; don't hold up the other users
+                    print(f"Listener Error for {user_id}: {e}")
+                    traceback.print_exc()
+
+            # Close listeners (and drop cached state) for deleted users
+            for user_id in list(LISTENERS.keys()):
+                if user_id in users:
+                    continue
+                print(f"Closing listener for removed user: {user_id}")
+                try:
+                    LISTENERS.pop(user_id).close()
+                except Exception as e:
+                    print(f"Listener Error for {user_id}: {e}")
+                with pending_lock:
+                    for key in [k for k in DIRTY_FIELDS if k[0] == user_id]:
+                        DIRTY_FIELDS.discard(key)
+                    for key in [k for k in list(LAST_ARCHIVE_TS) if k[0] == user_id]:
+                        LAST_ARCHIVE_TS.pop(key, None)
                         
         except Exception as e:
             print(f"Global Loop Error: {e}")
-            import traceback
             traceback.print_exc()
             
         print("Sleeping for 30 min...")
-        time.sleep(1800)  # Run every 30 mins
+        time.sleep(1800)  # Look for new users every 30 mins
 
 @app.on_event("startup")
 def start_background_tasks():
     print("Backend Starting - Launching Prediction Loop...")
     thread = threading.Thread(target=prediction_loop, daemon=True)
     thread.start()
+    sweeper = threading.Thread(target=dirty_field_sweeper, daemon=True)
+    sweeper.start()
 
 if __name__ == "__main__":
     port = int(os.getenv("PORT", 8000))
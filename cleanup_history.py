@@ -1,27 +1,34 @@
 
 import firebase_admin
 from firebase_admin import credentials, db
+from concurrent.futures import ThreadPoolExecutor
 
 cred = credentials.Certificate("serviceAccountKey.json")
 firebase_admin.initialize_app(cred, {
     "databaseURL": "https://esp32---demo-ac37f-default-rtdb.europe-west1.firebasedatabase.app"
 })
 
+def list_fields(user_id):
+    ls_data = db.reference(f"users/{user_id}/live_status").get(shallow=True)
+    if not isinstance(ls_data, dict): return []
+    return [(user_id, field_id) for field_id in ls_data.keys()]
+
+def delete_field_history(pair):
+    user_id, field_id = pair
+    # Check if history exists in ROOT history
+    hist_ref = db.reference(f"users/{user_id}/history/{field_id}")
+    if hist_ref.get(shallow=True):
+        print(f"Deleting history from users/{user_id}/history/{field_id}...")
+        hist_ref.delete()
+        print("Deleted.")
+
 def clean_history():
     print("Cleaning up live_status history...")
     users = db.reference("users").get(shallow=True) or {}
-    for user_id in users.keys():
-        ls_ref = db.reference(f"users/{user_id}/live_status")
-        ls_data = ls_ref.get()
-        if not ls_data: continue
-        
-        for field_id in ls_data.keys():
-            # Check if history exists in ROOT history
-            hist_ref = db.reference(f"users/{user_id}/history/{field_id}")
-            if hist_ref.get(shallow=True):
-                print(f"Deleting history from users/{user_id}/history/{field_id}...")
-                hist_ref.delete()
-                print("Deleted.")
+    # Every step is one Firebase round-trip, so fan them out across threads
+    with ThreadPoolExecutor(max_workers=32) as pool:
+        pairs = [p for fields in pool.map(list_fields, users.keys()) for p in fields]
+        list(pool.map(delete_field_history, pairs))
 
 if __name__ == "__main__":
     clean_history()